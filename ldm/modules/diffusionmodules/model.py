@@ -18,6 +18,8 @@ try:
 except:
     XFORMERS_IS_AVAILBLE = False
 
+SDP_IS_AVAILABLE = hasattr(torch.nn.functional, "scaled_dot_product_attention")
+
 def calc_mean_std(feat, eps=1e-5):
     """Calculate mean and std for adaptive_instance_normalization.
     Args:
@@ -222,18 +224,26 @@ class AttnBlock(nn.Module):
 
         # compute attention
         b,c,h,w = q.shape
-        q = q.reshape(b,c,h*w)
-        q = q.permute(0,2,1)   # b,hw,c
-        k = k.reshape(b,c,h*w) # b,c,hw
-        w_ = torch.bmm(q,k)     # b,hw,hw    w[b,i,j]=sum_c q[b,i,c]k[b,c,j]
-        w_ = w_ * (int(c)**(-0.5))
-        w_ = torch.nn.functional.softmax(w_, dim=2)
-
-        # attend to values
-        v = v.reshape(b,c,h*w)
-        w_ = w_.permute(0,2,1)   # b,hw,hw (first hw of k, second of q)
-        h_ = torch.bmm(v,w_)     # b, c,hw (hw of q) h_[b,c,j] = sum_i v[b,c,i] w_[b,i,j]
-        h_ = h_.reshape(b,c,h,w)
+        if SDP_IS_AVAILABLE:
+            q = q.reshape(b,c,h*w).permute(0,2,1)   # b,hw,c
+            k = k.reshape(b,c,h*w).permute(0,2,1)
+            v = v.reshape(b,c,h*w).permute(0,2,1)
+            # fused kernel; default scale matches int(c)**(-0.5)
+            h_ = torch.nn.functional.scaled_dot_product_attention(q, k, v)
+            h_ = h_.permute(0,2,1).reshape(b,c,h,w)
+        else:
+            q = q.reshape(b,c,h*w)
+            q = q.permute(0,2,1)   # b,hw,c
+            k = k.reshape(b,c,h*w) # b,c,hw
+            w_ = torch.bmm(q,k)     # b,hw,hw    w[b,i,j]=sum_c q[b,i,c]k[b,c,j]
+            w_ = w_ * (int(c)**(-0.5))
+            w_ = torch.nn.functional.softmax(w_, dim=2)
+
+            # attend to values
+            v = v.reshape(b,c,h*w)
+            w_ = w_.permute(0,2,1)   # b,hw,hw (first hw of k, second of q)
+            h_ = torch.bmm(v,w_)     # b, c,hw (hw of q) h_[b,c,j] = sum_i v[b,c,i] w_[b,i,j]
+            h_ = h_.reshape(b,c,h,w)
 
         h_ = self.proj_out(h_)
 
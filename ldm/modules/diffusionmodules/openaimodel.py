@@ -935,7 +935,7 @@ class UNetModel(nn.Module):
         ), "must specify y if and only if the model is class-conditional"
         hs = []
         t_emb = timestep_embedding(timesteps, self.model_channels, repeat_only=False)
-        emb = self.time_embed(t_emb)
+        emb = self.time_embed(t_emb.type(self.dtype))
 
         if self.num_classes is not None:
             assert y.shape == (x.shape[0],)
@@ -1318,7 +1318,7 @@ class UNetModelDualcondV2(nn.Module):
         ), "must specify y if and only if the model is class-conditional"
         hs = []
         t_emb = timestep_embedding(timesteps, self.model_channels, repeat_only=False)
-        emb = self.time_embed(t_emb)
+        emb = self.time_embed(t_emb.type(self.dtype))
 
         if self.num_classes is not None:
             assert y.shape == (x.shape[0],)
@@ -1520,7 +1520,7 @@ class EncoderUNetModelWT(nn.Module):
         :param timesteps: a 1-D batch of timesteps.
         :return: an [N x K] Tensor of outputs.
         """
-        emb = self.time_embed(timestep_embedding(timesteps, self.model_channels))
+        emb = self.time_embed(timestep_embedding(timesteps, self.model_channels).type(self.dtype))
 
         result_list = []
         results = {}